@@ -0,0 +1,126 @@
+"""
+Email Delivery
+
+SMTP sending for contact notifications, plus an optional Celery task so the
+mail server is talked to from a separate worker process instead of the API.
+
+Set CELERY_BROKER_URL (e.g. redis://localhost:6379/0) to enable the queue and
+run the worker with:  celery -A mailer.celery_app worker
+Without it, main.py falls back to FastAPI BackgroundTasks in-process.
+"""
+
+from email.mime.text import MIMEText
+import os
+import smtplib
+import threading
+from dotenv import load_dotenv
+
+# Load environment variables from .env file (the worker does not import database.py)
+load_dotenv()
+
+# SMTP settings are read once at startup
+SMTP_HOST = os.getenv("SMTP_HOST")
+SMTP_PORT = int(os.getenv("SMTP_PORT", "587"))
+SMTP_USER = os.getenv("SMTP_USER")
+SMTP_PASS = os.getenv("SMTP_PASS")
+SMTP_FROM = os.getenv("SMTP_FROM")
+# Socket timeout so a silently dropped connection can't hold _smtp_lock indefinitely
+SMTP_TIMEOUT = float(os.getenv("SMTP_TIMEOUT", "20"))
+
+# Shared SMTP connection, reused across background sends so TLS + AUTH happen once
+_smtp_server = None
+_smtp_lock = threading.Lock()
+
+def _get_smtp_server(host: str, port: int, user: str, password: str):
+    """Return the shared authenticated SMTP connection, dialing it if needed. Caller must hold _smtp_lock."""
+    global _smtp_server
+    if _smtp_server is None:
+        server = smtplib.SMTP(host, port, timeout=SMTP_TIMEOUT)
+        try:
+            server.starttls()
+            server.login(user, password)
+        except Exception:
+            server.close()
+            raise
+        _smtp_server = server
+    return _smtp_server
+
+def _drop_smtp_server():
+    """Close and forget the shared SMTP connection. Caller must hold _smtp_lock."""
+    global _smtp_server
+    if _smtp_server is not None:
+        try:
+            _smtp_server.close()
+        except Exception:
+            pass
+        _smtp_server = None
+
+def _is_connection_error(e: Exception) -> bool:
+    """True if the SMTP session itself is unusable (as opposed to this one message being rejected)"""
+    if isinstance(e, (smtplib.SMTPServerDisconnected, OSError)):
+        return True
+    return isinstance(e, smtplib.SMTPResponseException) and e.smtp_code == 421
+
+def _is_transient_error(e: Exception) -> bool:
+    """True for failures worth retrying later: connection problems and 4xx replies"""
+    if isinstance(e, (smtplib.SMTPServerDisconnected, smtplib.SMTPConnectError, OSError)):
+        return True
+    return isinstance(e, smtplib.SMTPResponseException) and 400 <= e.smtp_code < 500
+
+def send_email(to_email: str, subject: str, content: str):
+    """Send one email over the shared SMTP connection. Errors are raised so the caller can retry; does nothing if SMTP is not configured."""
+    if not (SMTP_HOST and SMTP_USER and SMTP_PASS):
+        # SMTP not configured; skip sending.
+        return
+
+    smtp_from = SMTP_FROM if SMTP_FROM is not None else (SMTP_USER or to_email)
+    msg = MIMEText(content, "plain", "utf-8")
+    msg["Subject"] = subject
+    msg["From"] = smtp_from
+    msg["To"] = to_email
+
+    with _smtp_lock:
+        try:
+            reused = _smtp_server is not None
+            try:
+                server = _get_smtp_server(SMTP_HOST, SMTP_PORT, SMTP_USER, SMTP_PASS)
+                server.sendmail(smtp_from, [to_email], msg.as_string())
+            except Exception as e:
+                if not (reused and _is_connection_error(e)):
+                    raise
+                # A reused connection went stale (e.g. a 421 after idling); redial once
+                _drop_smtp_server()
+                server = _get_smtp_server(SMTP_HOST, SMTP_PORT, SMTP_USER, SMTP_PASS)
+                server.sendmail(smtp_from, [to_email], msg.as_string())
+        except Exception as e:
+            # Keep a healthy session when only this message was rejected
+            if _is_connection_error(e):
+                _drop_smtp_server()
+            raise
+
+def send_email_background(to_email: str, subject: str, content: str):
+    """Simple email sender using SMTP if configured. This is optional; if not configured, we just store submission."""
+    try:
+        send_email(to_email, subject, content)
+    except Exception:
+        # swallow errors to not fail request
+        pass
+
+# Optional task queue; celery is only needed when a broker is configured
+celery_app = None
+
+broker_url = os.getenv("CELERY_BROKER_URL")
+
+if broker_url:
+    from celery import Celery
+    celery_app = Celery("mailer", broker=broker_url)
+
+    @celery_app.task(name="send_email", bind=True, ignore_result=True, max_retries=5)
+    def send_email_task(self, to_email: str, subject: str, content: str):
+        """Queue wrapper around send_email; retries transient failures with backoff, fails on permanent ones"""
+        try:
+            send_email(to_email, subject, content)
+        except Exception as e:
+            if _is_transient_error(e):
+                raise self.retry(exc=e, countdown=min(10 * 2 ** self.request.retries, 600))
+            raise
@@ -1,30 +1,97 @@
+import asyncio
+import logging
 import os
-from fastapi import FastAPI, HTTPException, BackgroundTasks
+from fastapi import FastAPI, HTTPException, BackgroundTasks, Header
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse
 from pydantic import BaseModel, EmailStr
 from typing import List, Optional
-from database import db, create_document, get_documents
+from async_lru import alru_cache
+from database import db, create_document, get_documents, QUERY_MAX_TIME_MS
+from mailer import celery_app, send_email_background
 from schemas import Player, Testimonial, ContactSubmission
-from datetime import datetime
+from datetime import datetime, timezone
+from pymongo.errors import ConnectionFailure, DuplicateKeyError
 import re
+import secrets
 
-app = FastAPI(title="Player Landing Backend")
+logger = logging.getLogger(__name__)
+
+app = FastAPI(title="Player Landing Backend", default_response_class=ORJSONResponse)
+
+# Comma-separated list of frontend origins, e.g. "https://example.com,https://www.example.com".
+# Without it we fall back to a credential-less wildcard, which is the only spec-valid use of "*".
+cors_origins = [o.strip() for o in os.getenv("CORS_ORIGINS", "").split(",") if o.strip()]
 
 app.add_middleware(
     CORSMiddleware,
-    allow_origins=["*"],
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
+    allow_origins=cors_origins or ["*"],
+    allow_credentials=bool(cors_origins),
+    allow_methods=["GET", "POST"],
+    allow_headers=["content-type", "authorization"],
+    max_age=86400,
 )
 
+# Set once the unique slug index is confirmed; until then create_player also checks for duplicates
+indexes_ready = False
+INDEX_RETRY_SECONDS = 5
+_index_retry_task = None
+
+async def _create_indexes():
+    global indexes_ready
+    await PLAYERS.create_index("slug", unique=True)
+    await TESTIMONIALS.create_index("player_slug")
+    indexes_ready = True
+
+async def _retry_indexes():
+    """Keep trying to create indexes until Mongo becomes reachable"""
+    while True:
+        await asyncio.sleep(INDEX_RETRY_SECONDS)
+        try:
+            await _create_indexes()
+            logger.warning("MongoDB indexes created after retry")
+            return
+        except ConnectionFailure as e:
+            logger.warning("MongoDB still unreachable, retrying index creation: %s", e)
+        except Exception:
+            # Duplicate slugs or similar; the pre-insert check stays active (see README)
+            logger.exception("Could not create MongoDB indexes")
+            return
+
+@app.on_event("startup")
+async def ensure_indexes():
+    """Create indexes backing slug uniqueness and testimonial lookups"""
+    global _index_retry_task
+    if db is None:
+        return
+    # Duplicate slugs (DuplicateKeyError/OperationFailure) fail startup; see README.
+    # An unreachable database does not, so /test can still report the problem.
+    try:
+        await _create_indexes()
+    except ConnectionFailure as e:
+        logger.warning("MongoDB unreachable, will retry index creation: %s", e)
+        _index_retry_task = asyncio.create_task(_retry_indexes())
+
 @app.get("/")
-def root():
+async def root():
     return {"message": "Player Landing Backend running"}
 
+# Diagnostics are off unless ENABLE_DIAG is 1/true/yes, and then require "Authorization: Bearer <DIAG_TOKEN>"
+DIAG_ENABLED = os.getenv("ENABLE_DIAG", "").lower() in ("1", "true", "yes")
+DIAG_TOKEN = os.getenv("DIAG_TOKEN")
+
 @app.get("/test")
-def test_database():
+async def test_database(authorization: Optional[str] = Header(None)):
     """Test endpoint to check if database is available and accessible"""
+    if not (DIAG_ENABLED and DIAG_TOKEN):
+        raise HTTPException(status_code=404, detail="Not Found")
+    if not secrets.compare_digest((authorization or "").encode(), f"Bearer {DIAG_TOKEN}".encode()):
+        raise HTTPException(status_code=401, detail="Unauthorized")
+    return await _database_status()
+
+@alru_cache(maxsize=1, ttl=30)
+async def _database_status():
+    """Build the /test report; cached so repeated hits don't round-trip to Mongo"""
     response = {
         "backend": "✅ Running",
         "database": "❌ Not Available",
@@ -40,7 +107,7 @@ def test_database():
             response["database_url"] = "✅ Set" if os.getenv("DATABASE_URL") else "❌ Not Set"
             response["database_name"] = "✅ Set" if os.getenv("DATABASE_NAME") else "❌ Not Set"
             try:
-                collections = db.list_collection_names()
+                collections = await db.list_collection_names()
                 response["collections"] = collections[:10]
                 response["database"] = "✅ Connected & Working"
                 response["connection_status"] = "Connected"
@@ -54,50 +121,65 @@ def test_database():
     return response
 
 # ------------------- Utility --------------------
-slug_regex = re.compile(r"^[a-z0-9]+(?:-[a-z0-9]+)*$")
+slug_regex = re.compile(r"[a-z0-9]+(?:-[a-z0-9]+)*")
+SLUG_MAX_LENGTH = 64
 
 def collection_name(model_cls):
     return model_cls.__name__.lower()
 
+# Resolve collection names and handles once instead of on every request
+PLAYER_COLLECTION = collection_name(Player)
+TESTIMONIAL_COLLECTION = collection_name(Testimonial)
+CONTACT_COLLECTION = collection_name(ContactSubmission)
+
+PLAYERS = db[PLAYER_COLLECTION] if db is not None else None
+TESTIMONIALS = db[TESTIMONIAL_COLLECTION] if db is not None else None
+CONTACTS = db[CONTACT_COLLECTION] if db is not None else None
+
 # ------------------- Players --------------------
 @app.post("/api/players", response_model=Player)
-def create_player(player: Player):
-    if not slug_regex.match(player.slug):
+async def create_player(player: Player):
+    if not (1 <= len(player.slug) <= SLUG_MAX_LENGTH and slug_regex.fullmatch(player.slug)):
         raise HTTPException(status_code=400, detail="Invalid slug. Use lowercase letters, numbers and dashes.")
-    # Ensure slug unique
-    existing = list(db[collection_name(Player)].find({"slug": player.slug}).limit(1)) if db else []
-    if existing:
+    # Slug uniqueness is enforced by the unique index on player.slug once it exists
+    if not indexes_ready and PLAYERS is not None and await PLAYERS.find_one({"slug": player.slug}, projection={"_id": 1}, max_time_ms=QUERY_MAX_TIME_MS):
         raise HTTPException(status_code=409, detail="Slug already exists")
-    _id = create_document(collection_name(Player), player)
-    created = db[collection_name(Player)].find_one({"_id": db[collection_name(Player)]._Database__client.get_default_database().codec_options.document_class()._id}) if False else None
-    # Fetch freshly created document
-    created = db[collection_name(Player)].find_one({"slug": player.slug})
-    created["_id"] = str(created["_id"])  # convert id for response safety
-    return Player(**{k: v for k, v in created.items() if k != "_id"})
+    try:
+        await create_document(PLAYER_COLLECTION, player)
+    except DuplicateKeyError:
+        raise HTTPException(status_code=409, detail="Slug already exists")
+    # The validated body is exactly what was stored; no need to read it back
+    return player
 
-@app.get("/api/players/{slug}", response_model=Player)
-def get_player(slug: str):
-    doc = db[collection_name(Player)].find_one({"slug": slug})
+@alru_cache(maxsize=1024, ttl=30)
+async def _fetch_player(slug: str):
+    """Read a player document, cached per worker for a few seconds"""
+    doc = await PLAYERS.find_one({"slug": slug}, projection={"_id": 0}, max_time_ms=QUERY_MAX_TIME_MS)
     if not doc:
+        # Raising keeps misses out of the cache (async-lru never stores exceptions; pinned in
+        # requirements.txt), so a newly created player is visible on every worker
         raise HTTPException(status_code=404, detail="Player not found")
-    doc.pop("_id", None)
-    return Player(**doc)
+    return doc
+
+@app.get("/api/players/{slug}", response_model=Player)
+async def get_player(slug: str):
+    doc = await _fetch_player(slug)
+    # Stored players were validated on write; response_model filters the output
+    return doc
 
 # ---------------- Testimonials ------------------
 @app.get("/api/players/{slug}/testimonials", response_model=List[Testimonial])
-def list_testimonials(slug: str):
-    docs = db[collection_name(Testimonial)].find({"player_slug": slug})
-    res = []
-    for d in docs:
-        d.pop("_id", None)
-        res.append(Testimonial(**d))
-    return res
+async def list_testimonials(slug: str):
+    cursor = TESTIMONIALS.find({"player_slug": slug}, projection={"_id": 0}, max_time_ms=QUERY_MAX_TIME_MS)
+    docs = await cursor.to_list(length=None)
+    # Stored testimonials were validated on write; response_model does the single validation pass
+    return docs
 
 @app.post("/api/players/{slug}/testimonials", response_model=Testimonial)
-def add_testimonial(slug: str, testimonial: Testimonial):
+async def add_testimonial(slug: str, testimonial: Testimonial):
     if testimonial.player_slug != slug:
         raise HTTPException(status_code=400, detail="player_slug mismatch")
-    create_document(collection_name(Testimonial), testimonial)
+    await create_document(TESTIMONIAL_COLLECTION, testimonial)
     return testimonial
 
 # ----------------- Contact Form -----------------
@@ -112,65 +194,63 @@ class ContactEmailPayload(BaseModel):
     message: Optional[str] = None
 
 
-def send_email_background(to_email: str, subject: str, content: str):
-    """Simple email sender using SMTP if configured. This is optional; if not configured, we just store submission."""
-    import smtplib
-    from email.mime.text import MIMEText
-
-    smtp_host = os.getenv("SMTP_HOST")
-    smtp_port = int(os.getenv("SMTP_PORT", "587"))
-    smtp_user = os.getenv("SMTP_USER")
-    smtp_pass = os.getenv("SMTP_PASS")
-    smtp_from = os.getenv("SMTP_FROM", smtp_user or to_email)
-
-    if not (smtp_host and smtp_user and smtp_pass):
-        # SMTP not configured; skip sending.
-        return
-
-    msg = MIMEText(content, "plain", "utf-8")
-    msg["Subject"] = subject
-    msg["From"] = smtp_from
-    msg["To"] = to_email
-
-    try:
-        with smtplib.SMTP(smtp_host, smtp_port) as server:
-            server.starttls()
-            server.login(smtp_user, smtp_pass)
-            server.sendmail(smtp_from, [to_email], msg.as_string())
-    except Exception:
-        # swallow errors to not fail request
-        pass
+EMAIL_TEMPLATE = (
+    "Name: {name}\n"
+    "Role: {role}\n"
+    "Club: {club}\n"
+    "Email: {email}\n"
+    "WhatsApp: {whatsapp}\n"
+    "Country: {country}\n"
+    "\n"
+    "Message:\n{message}\n"
+    "\n"
+    "Submitted at: {submitted_at}"
+)
 
 @app.post("/api/players/{slug}/contact")
-def submit_contact(slug: str, payload: ContactSubmission, background_tasks: BackgroundTasks):
+async def submit_contact(slug: str, payload: ContactSubmission, background_tasks: BackgroundTasks):
     if payload.player_slug != slug:
         raise HTTPException(status_code=400, detail="player_slug mismatch")
 
-    # Store submission
-    create_document(collection_name(ContactSubmission), payload)
+    if db is None:
+        raise Exception("Database not available. Check DATABASE_URL and DATABASE_NAME environment variables.")
 
-    # Lookup player email
-    player = db[collection_name(Player)].find_one({"slug": slug})
+    # Store submission and look up the player's email concurrently
+    _, player = await asyncio.gather(
+        create_document(CONTACT_COLLECTION, payload),
+        PLAYERS.find_one({"slug": slug}, projection={"contact_email": 1, "name": 1, "_id": 0}, max_time_ms=QUERY_MAX_TIME_MS),
+    )
     if player and player.get("contact_email"):
         subject = f"New Contact/Trial Request for {player.get('name')}"
-        lines = [
-            f"Name: {payload.name}",
-            f"Role: {payload.role}",
-            f"Club: {payload.club_name or '-'}",
-            f"Email: {payload.email or '-'}",
-            f"WhatsApp: {payload.whatsapp or '-'}",
-            f"Country: {payload.country or '-'}",
-            "",
-            f"Message:\n{payload.message or '-'}",
-            "",
-            f"Submitted at: {datetime.utcnow().isoformat()} UTC"
-        ]
-        content = "\n".join(lines)
-        background_tasks.add_task(send_email_background, player.get("contact_email"), subject, content)
+        submitted_at = datetime.now(timezone.utc).isoformat(timespec="seconds")
+        content = EMAIL_TEMPLATE.format_map({
+            "name": payload.name,
+            "role": payload.role,
+            "club": payload.club_name or "-",
+            "email": payload.email or "-",
+            "whatsapp": payload.whatsapp or "-",
+            "country": payload.country or "-",
+            "message": payload.message or "-",
+            "submitted_at": submitted_at,
+        })
+        if celery_app is not None:
+            # Publish after the response is sent; a worker process does the SMTP work
+            background_tasks.add_task(celery_app.send_task, "send_email", args=[player.get("contact_email"), subject, content])
+        else:
+            background_tasks.add_task(send_email_background, player.get("contact_email"), subject, content)
 
     return {"status": "ok"}
 
 if __name__ == "__main__":
     import uvicorn
     port = int(os.getenv("PORT", 8000))
-    uvicorn.run(app, host="0.0.0.0", port=port)
+    # Import string form is required for uvicorn to spawn multiple workers
+    uvicorn.run(
+        "main:app",
+        host="0.0.0.0",
+        port=port,
+        loop="uvloop",
+        http="httptools",
+        workers=int(os.getenv("WEB_CONCURRENCY", os.cpu_count() or 2)),
+        log_level="warning",
+    )